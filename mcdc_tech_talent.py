@@ -1,11 +1,12 @@
-import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import gspread
 import pandas as pd
 from src.google_api import create_service
-from src.google_api import get_file_id, download_file
-from src.process_bls import process_bls
+from src.google_api import get_file_id, list_files, index_file_ids, download_file
+from src.process_bls import DB_RAW_DIR, process_bls
 
 
 DATA_DIR = 'data'
@@ -16,6 +17,8 @@ DB_PATH = Path() / DB_DIR
 
 API_KEY = 'key.json'
 
+DOWNLOAD_WORKERS = 8
+
 
 def download_project_data(secret):
     """ Downloads all remote data files to local project folder"""
@@ -23,23 +26,41 @@ def download_project_data(secret):
     scope = ['https://www.googleapis.com/auth/drive']
     service = create_service(secret, 'drive', 'v3', scope)
 
+    # Drive service objects aren't thread-safe, so give each download
+    # thread its own
+    thread_data = threading.local()
+
+    def download(file, download_path):
+        if not hasattr(thread_data, 'service'):
+            thread_data.service = create_service(secret, 'drive', 'v3', scope)
+        download_file(thread_data.service, file['id'], file['name'],
+                      download_path, metadata=file)
+
     data_folder_id = get_file_id(service,
                                  file_name=DATA_DIR,
                                  mime_type='application/vnd.google-apps.folder')
 
+    # List the data folder once rather than searching for each subfolder
+    folder_ids = index_file_ids(list_files(service, data_folder_id))
+
     sub_folders = ['bls', 'bg', 'ipeds', 'lookups']
 
-    for folder in sub_folders:
-        dl_folder_id = get_file_id(service, folder, parent_id=data_folder_id)
-        results = service.files().list(
-            q="parents in '{}' and trashed=False".format(dl_folder_id),
-            fields='files(name, id)').execute()
+    downloads = []
 
-        download_path = DATA_PATH / folder
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+        for folder in sub_folders:
+            files = list_files(service, folder_ids[folder],
+                               fields='name, id, modifiedTime, size')
 
-        print("Downloading remote files to local project...")
-        for file in results['files']:
-            download_file(service, file['id'], file['name'], download_path)
+            download_path = DATA_PATH / folder
+
+            print("Downloading remote files to local project...")
+            downloads += [executor.submit(download, file, download_path)
+                          for file in files]
+
+    # Surface any errors raised in the download threads
+    for download_job in downloads:
+        download_job.result()
 
 
 def upload_db_data(secret, db_path):
@@ -53,19 +74,30 @@ def upload_db_data(secret, db_path):
                                file_name=DB_DIR,
                                mime_type='application/vnd.google-apps.folder')
 
-    files = [f.name for f in os.scandir(DB_PATH) if f.name.endswith('.xlsx')]
+    # List the db folder once rather than searching for each sheet
+    sheet_ids = index_file_ids(list_files(drive_service, db_folder_id))
+
+    for file in sorted((db_path / DB_RAW_DIR).glob('*.parquet')):
+        file_id = sheet_ids.get(file.stem)
+
+        if not file_id:
+            print("No Google Sheet found for {}, skipping...".format(file.name))
+            continue
 
-    for file in files:
-        print("Loading {} to Google Sheets".format(file))
-        df = pd.read_excel(db_path / file)
+        print("Loading {} to Google Sheets".format(file.name))
+        df = pd.read_parquet(file, engine='pyarrow')
 
-        file_id = get_file_id(drive_service,
-                              file[:-5],
-                              parent_id=db_folder_id)
+        # Blank out nulls, casting to object first so categorical columns
+        # accept the empty string
+        values = df.astype(object).where(df.notna(), '').values.tolist()
 
+        # Clear first so no stale rows remain past the end of the new data.
+        # Writing through the spreadsheet skips fetching sheet1's metadata.
         sh = sheet_service.open_by_key(file_id)
         sh.values_clear("'Sheet1'!A:AAA")
-        sh.sheet1.update([df.columns.values.tolist()] + df.fillna('').values.tolist())
+        sh.values_update("'Sheet1'!A1",
+                         params={'valueInputOption': 'RAW'},
+                         body={'values': [df.columns.tolist()] + values})
 
 
 def main():
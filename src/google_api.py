@@ -1,10 +1,14 @@
-import io
+from datetime import datetime
 
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
 
 
+# Download files in 8 MB chunks rather than the 100 KB default
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+
 def create_service(api_key, api_name, api_version, scope):
 
     creds = service_account.Credentials.from_service_account_file(api_key, scopes=scope)
@@ -58,35 +62,108 @@ def get_file_id(service, file_name, mime_type=None, parent_id=None):
     return file_id
 
 
-def download_file(service, file_id, file_name, download_path):
+def list_files(service, parent_id, fields='name, id'):
+    """Return all files contained in a Google Drive folder
+
+    :param service: A Google Drive API service object
+    :param parent_id: A string, id of the folder to list
+    :param fields: A string, file metadata fields to retrieve
+
+    :return files: A list of dictionaries, metadata for each file found
+    """
+
+    files = []
+    page_token = None
+
+    while True:
+        results = service.files().list(
+            q="parents in '{}' and trashed=False".format(parent_id),
+            fields='nextPageToken, files({})'.format(fields),
+            pageSize=1000,
+            pageToken=page_token).execute()
+
+        files += results['files']
+        page_token = results.get('nextPageToken')
+
+        if not page_token:
+            return files
+
+
+def index_file_ids(files):
+    """Return a lookup of Google Drive file IDs by file name
+
+    :param files: A list of dictionaries, file metadata from list_files()
+
+    :return file_ids: A dictionary, file name to file ID of the first file
+        found with that name
+    """
+
+    file_ids = {}
+
+    for file in files:
+        if file['name'] in file_ids:
+            print('Multiple files named {} found, using first from list'.format(file['name']))
+        file_ids.setdefault(file['name'], file['id'])
+
+    return file_ids
+
+
+def is_local_current(service, file_id, file_path, metadata=None):
+    """Check whether a local file matches the latest version on Google Drive
+
+    :param service: A Google Drive API service object
+    :param file_id: A string, file ID of the remote file
+    :param file_path: A pathlib.Path() object, location of the local file
+    :param metadata: A dictionary, optional Drive metadata of the remote file
+        containing modifiedTime and size, fetched if not provided
+
+    :return: A boolean, True if the local file has the same size and is no
+        older than the remote file
+    """
+
+    if metadata is None:
+        metadata = service.files().get(fileId=file_id,
+                                       fields='modifiedTime, size').execute()
+
+    # Drive returns RFC 3339 UTC timestamps, e.g. 2021-07-01T12:00:00.000Z
+    remote_time = datetime.fromisoformat(metadata['modifiedTime'].replace('Z', '+00:00'))
+    local_stat = file_path.stat()
+
+    return (int(metadata.get('size', -1)) == local_stat.st_size
+            and remote_time.timestamp() <= local_stat.st_mtime)
+
+
+def download_file(service, file_id, file_name, download_path, metadata=None):
     """Downloads a file from Google Drive to project folder
 
     :param service: A Google Drive API service object
     :param file_id: A string, file ID of the file to download
     :param file_name: A string, name and extension of file to save locally
     :param download_path: A pathlib.Path() object, folder to save file in
+    :param metadata: A dictionary, optional Drive metadata of the file
+        containing modifiedTime and size, fetched if not provided
 
     :return None
     """
 
     file_path = download_path / file_name
 
-    if file_path.is_file():
-        print('...{} exists locally, skipping...'.format(file_path))
+    if file_path.is_file() and is_local_current(service, file_id, file_path, metadata):
+        print('...{} is up to date locally, skipping...'.format(file_path))
     else:
         request = service.files().get_media(fileId=file_id)
 
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fd=fh, request=request)
-
-        done = False
-
-        while not done:
-            status, done = downloader.next_chunk()
-            print('...Downloading {}... {}'.format(file_path, status.progress() * 100))
+        try:
+            with open(file_path, 'wb') as fh:
+                downloader = MediaIoBaseDownload(fd=fh, request=request,
+                                                 chunksize=DOWNLOAD_CHUNK_SIZE)
 
-        fh.seek(0)
+                done = False
 
-        with open(file_path, 'wb') as f:
-            f.write(fh.read())
-            f.close()
+                while not done:
+                    status, done = downloader.next_chunk()
+                    print('...Downloading {}... {}'.format(file_path, status.progress() * 100))
+        except Exception:
+            # Don't leave a partial file behind to be skipped next time
+            file_path.unlink(missing_ok=True)
+            raise
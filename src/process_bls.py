@@ -1,18 +1,41 @@
 import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 
-import numpy as np
 import pandas as pd
 
 
+# Release year embedded in BLS OEWS file names, e.g. MSA_M2019_dl.xlsx
+BLS_YEAR_RE = re.compile(r"M([1-9]\d{3,})_")
+
+# BLS OEWS columns used to build the cleaned data set
+BLS_COLUMNS = ['area', 'area_title', 'o_group', 'occ_code', 'occ_title',
+               'tot_emp', 'emp_prse', 'jobs_1000', 'loc_quotient',
+               'h_mean', 'a_mean', 'mean_prse',
+               'h_pct10', 'h_pct25', 'h_median', 'h_pct75', 'h_pct90',
+               'a_pct10', 'a_pct25', 'a_median', 'a_pct75', 'a_pct90']
+
+# Column headers used inconsistently from year to year
+BLS_RENAMES = {'occ_group': 'o_group',
+               'loc quotient': 'loc_quotient',
+               'area_name': 'area_title'}
+
+# Markers BLS uses for missing or unreported values
+BLS_NA_VALUES = ['#', '*', '**']
+
+# Sub folder of the db dir holding processed data files awaiting upload
+DB_RAW_DIR = '.raw'
+
+
 def load_msa_lookup(data_path):
     """ Loads a lookup table for various MSA specific attributes used
     throughout the project.
 
     :param data_path: a pathlib.Path() object, location of data file folder
 
-    :return msa_lookup: a dictionary of dictionaries containing MSA code to
-        peer type lookup and MSA code to MSA name lookup
+    :return msa_lookup: a pandas dataframe indexed by MSA code containing
+        peer type and MSA name lookups
 
     """
 
@@ -21,12 +44,12 @@ def load_msa_lookup(data_path):
 
     lookup_file_path = data_path / lookup_dir / msa_file_name
 
-    msa_lookup = {}
-
     try:
-        lk_msa = pd.read_excel(lookup_file_path)
-        msa_lookup['peer_type'] = dict(zip(lk_msa['area'], lk_msa['peer_type']))
-        msa_lookup['area_title'] = dict(zip(lk_msa['area'], lk_msa['area_title']))
+        lk_msa = pd.read_excel(lookup_file_path, engine='calamine')
+        msa_lookup = (lk_msa[['area', 'peer_type', 'area_title']]
+                      .drop_duplicates()
+                      .astype({'area_title': 'string[pyarrow]'})
+                      .set_index('area'))
         print("...MSA lookup table loaded.")
         return msa_lookup
     except Exception as e:
@@ -49,14 +72,18 @@ def load_oes_lookup(data_path):
     lookup_file_path = data_path / lookup_dir / oes_file_name
 
     try:
-        # skip first 5 rows that contain notes
-        df = pd.read_excel(lookup_file_path, sheet_name=0, skiprows=5)
-
-        # rename column headers for easier manipulation
-        df.columns = ['oes_code_2019', 'oes_title_2019',
-                      'soc_code_2018', 'soc_title_2018',
-                      'oes_code_2018', 'oes_title_2018',
-                      'soc_code_2010', 'soc_title_2010', 'notes']
+        # skip first 5 rows that contain notes, and rename column headers
+        # for easier manipulation
+        df = pd.read_excel(lookup_file_path, sheet_name=0, skiprows=5,
+                           header=0, engine='calamine',
+                           names=['oes_code_2019', 'oes_title_2019',
+                                  'soc_code_2018', 'soc_title_2018',
+                                  'oes_code_2018', 'oes_title_2018',
+                                  'soc_code_2010', 'soc_title_2010', 'notes'],
+                           dtype={'oes_code_2019': str,
+                                  'soc_code_2018': str,
+                                  'oes_code_2018': str,
+                                  'soc_code_2010': str})
 
         # create SOC2010 to OES2019 for 2015 and 2016
         # create OES2018 to OES2019 for unmatched 2015 and 2016, and 2017-2020
@@ -89,11 +116,14 @@ def much_consistency(df):
     print("...Forced column headers to lower case.")
 
     # Rename column headers used inconsistently from year to year
-    df.rename(columns={'occ_group': 'o_group',
-                       'loc quotient': 'loc_quotient',
-                       'area_name': 'area_title'}, inplace=True)
+    df.rename(columns=BLS_RENAMES, inplace=True)
     print("...Standardized column header names.")
 
+    # Store heavily repeated text columns as categoricals
+    for col in ('o_group', 'area', 'occ_code'):
+        df[col] = df[col].astype('category')
+    print("...Converted repeated values to categories.")
+
     return df
 
 
@@ -117,43 +147,40 @@ def map_soc(df, report_year, soc_lookup):
     elif report_year >= 2019:
         soc_mappings = soc_lookup['1919']
 
-    # Apply SOC code crosswalk
-    df['oes_code_2019'] = df[df['o_group'] == 'detailed']['occ_code'].map(soc_mappings)
-
-    # Map the couple codes that didn't have a 2010 to 2019 conversion separately
-    df_matched = df[(~df['oes_code_2019'].isnull()) & (df['o_group'] == 'detailed')].copy()
-    df_missing = df[(df['oes_code_2019'].isnull()) & (df['o_group'] == 'detailed')].copy()
-    df_missing['oes_code_2019'] = df_missing['occ_code'].map(soc_lookup['1819'])
+    is_detailed = df['o_group'] == 'detailed'
 
-    # Map the total and major rows separately, because these aren't in the federal crosswalk
-    df_totals = df[df['o_group'] != 'detailed'].copy()
-    df_totals['oes_code_2019'] = df_totals['occ_code']
-    df_totals['oes_title_2019'] = df_totals['occ_title']
+    # Apply SOC code crosswalk, mapping the couple codes that didn't have a
+    # 2010 to 2019 conversion separately. Mapping the categorical occ_code
+    # can return categories, so fall back to object before filling.
+    oes_codes = df['occ_code'].map(soc_mappings).astype(object)
+    oes_codes = oes_codes.fillna(df['occ_code'].map(soc_lookup['1819']))
 
-    # Recombine all rows
-    df_combined = pd.concat([df_matched, df_missing])
-    df_combined['oes_title_2019'] = df_combined['oes_code_2019'].map(soc_lookup['19'])
-
-    df_f = pd.concat([df_combined, df_totals])
+    # Total and major rows keep their own codes and titles, because these
+    # aren't in the federal crosswalk
+    df['oes_code_2019'] = oes_codes.where(is_detailed, df['occ_code'])
+    df['oes_title_2019'] = df['oes_code_2019'].map(soc_lookup['19']).where(
+        is_detailed, df['occ_title'])
 
     print("...Applied SOC crosswalks.")
 
-    return df_f
+    return df
 
 
 def map_peer_type(df, msa_lookup):
     """ Helper function to apply peer group mapping to MSA locations
 
     :param df: A pandas dataframe, BLS OEWS data set
-    :param msa_lookup: a dictionary containing MSA code to peer type lookup
+    :param msa_lookup: a pandas dataframe, loaded via load_msa_lookup()
 
     :return df: A pandas dataframe
 
     """
 
-    # Map MSA areas to peer type categories
-    df['peer_type'] = df['area'].map(msa_lookup['peer_type'])
-    df['peer_type'].fillna("All Other MSA", inplace=True)
+    # Map MSA areas to peer type categories. Reindexing the lookup by area
+    # is a single hash lookup, and raises if an MSA code is listed more than
+    # once in the lookup table.
+    peer_type = msa_lookup['peer_type'].reindex(df['area'])
+    df['peer_type'] = pd.Categorical(peer_type.fillna("All Other MSA").to_numpy())
     print("...Applied MSA lookups.")
 
     return df
@@ -163,26 +190,72 @@ def map_msa_names(df, msa_lookup):
     """ Helper function to handle known MSA name changes/inconsistencies
 
     :param df: A pandas dataframe, BLS OEWS data set
-    :param msa_lookup: a dictionary containing MSA code to peer type lookup
+    :param msa_lookup: a pandas dataframe, loaded via load_msa_lookup()
 
     :return df: A pandas dataframe
     """
 
-    df['area_title'] = df['area'].map(msa_lookup['area_title'])
+    df['area_title'] = msa_lookup['area_title'].reindex(df['area']).array
 
     return df
 
 
-def map_nulls(df):
-    """ Helper function to convert missing or unreported values into nulls
+def use_bls_column(col):
+    """ Helper function to select BLS OEWS columns while reading data files,
+    regardless of the header's case or naming in a given year
 
-    :param df: A pandas dataframe, BLS OEWS data set
+    :param col: A string, raw column header
 
-    :return df: a pandas dataframe
+    :return: A boolean, True if the column is in BLS_COLUMNS
     """
-    null_replace = {'#': np.nan, '*': np.nan, '**': np.nan}
-    df.replace(null_replace, inplace=True)
-    print("...Replaced missing and unreported values with nulls.")
+    col = str(col).lower()
+
+    return BLS_RENAMES.get(col, col) in BLS_COLUMNS
+
+
+def clean_bls_file(f, soc_lookup, msa_lookup):
+    """ Helper function to clean a single year of BLS OEWS data. Runs in a
+    worker process, so all arguments must be picklable.
+
+    :param f: A pathlib.Path() object, location of BLS OEWS data file
+    :param soc_lookup: A dictionary, crosswalk loaded via load_oes_lookup()
+    :param msa_lookup: a pandas dataframe, loaded via load_msa_lookup()
+
+    :return df: A pandas dataframe
+    """
+    print('Processing {} ...'.format(f))
+
+    # Only read the columns in use, and parse missing or unreported value
+    # markers into nulls as the file is read
+    with pd.ExcelFile(f, engine='calamine') as xl:
+        df = xl.parse(sheet_name=0, usecols=use_bls_column,
+                      na_values=BLS_NA_VALUES)
+
+    df = much_consistency(df)
+
+    report_year = int(BLS_YEAR_RE.search(str(f)).group(1))
+
+    df = map_soc(df, report_year, soc_lookup)
+    df = map_peer_type(df, msa_lookup)
+
+    # Store crosswalked codes and titles as Arrow-backed strings, these have
+    # too many distinct values to gain much from categories
+    for col in ('oes_code_2019', 'oes_title_2019'):
+        df[col] = df[col].astype('string[pyarrow]')
+
+    df['report_year'] = report_year
+
+    # Drop MSAs outside the peer groups before years are merged together
+    df = df[df['peer_type'] != 'All Other MSA']
+
+    df = df[['report_year', 'area', 'area_title', 'peer_type',
+             'oes_code_2019', 'oes_title_2019', 'o_group',
+             'tot_emp', 'emp_prse', 'jobs_1000', 'loc_quotient',
+             'h_mean', 'a_mean', 'mean_prse',
+             'h_pct10', 'h_pct25', 'h_median', 'h_pct75', 'h_pct90',
+             'a_pct10', 'a_pct25', 'a_median', 'a_pct75', 'a_pct90']]
+
+    print('...{} processing complete.'.format(f))
 
     return df
 
@@ -195,41 +268,21 @@ def clean_bls(data_path):
     :return df_merged: A pandas dataframe, cleaned and merged dataframe
                        containing all available years of BLS OEWS data
     """
-    df_merged = pd.DataFrame()
-
     bls_folder = data_path / 'bls'
 
     soc_lookup = load_oes_lookup(data_path)
     msa_lookup = load_msa_lookup(data_path)
 
-    for f in bls_folder.glob('**/*.xlsx'):
-        print('Processing {} ...'.format(f))
-
-        with open(f, 'rb') as file:
-            df = pd.read_excel(file)
-
-        df = much_consistency(df)
+    # Each year's file is independent, so clean them in parallel
+    clean_file = partial(clean_bls_file,
+                         soc_lookup=soc_lookup,
+                         msa_lookup=msa_lookup)
 
-        report_year = int(re.search(r"(M)([1-9]\d{3,})(_)", str(f))[2])
+    with ProcessPoolExecutor() as executor:
+        frames = list(executor.map(clean_file, bls_folder.glob('**/*.xlsx')))
 
-        df = map_soc(df, report_year, soc_lookup)
-        df = map_peer_type(df, msa_lookup)
+    df_merged = pd.concat(frames, ignore_index=True)
 
-        df = map_nulls(df)
-        df['report_year'] = report_year
-
-        df = df[['report_year', 'area', 'area_title', 'peer_type',
-                 'oes_code_2019', 'oes_title_2019', 'o_group',
-                 'tot_emp', 'emp_prse', 'jobs_1000', 'loc_quotient',
-                 'h_mean', 'a_mean', 'mean_prse',
-                 'h_pct10', 'h_pct25', 'h_median', 'h_pct75', 'h_pct90',
-                 'a_pct10', 'a_pct25', 'a_median', 'a_pct75', 'a_pct90']
-                ].reset_index(drop=True)
-
-        df_merged = pd.concat([df_merged, df])
-        print('...{} processing complete.'.format(f))
-
-    df_merged = df_merged[df_merged['peer_type'] != 'All Other MSA']
     #df_merged = df_merged[df_merged['oes_code_2019'].str.contains('15-')]
 
     df_merged = map_msa_names(df_merged, msa_lookup)
@@ -266,10 +319,15 @@ def process_bls(data_path, db_path):
     bls_merged = clean_bls(data_path)
     bls_total, bls_major, bls_detailed = split_bls_ogroup(bls_merged)
 
-    print("Saving BLS files to {}".format(db_path))
-    bls_total.to_excel(db_path / 'bls.total.xlsx', index=False)
-    bls_major.to_excel(db_path / 'bls.major.xlsx', index=False)
-    bls_detailed.to_excel(db_path / 'bls.detailed.xlsx', index=False)
+    raw_path = db_path / DB_RAW_DIR
+    raw_path.mkdir(exist_ok=True)
+
+    print("Saving BLS files to {}".format(raw_path))
+    for name, df in [('bls.total', bls_total),
+                     ('bls.major', bls_major),
+                     ('bls.detailed', bls_detailed)]:
+        df.to_parquet(raw_path / '{}.parquet'.format(name), engine='pyarrow',
+                      compression='zstd', index=False)
 
 
 if __name__ == "__main__":